@@ -5,15 +5,21 @@
 from __future__ import annotations
 
 import argparse
+import functools
+import hashlib
 import json
+import os
+import pickle
+import platform
 import re
-from collections import Counter
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Iterable
+from typing import Callable, Iterable, Iterator
 
 import frontmatter  # type: ignore
 import MeCab  # type: ignore
-from PIL import Image
 from wordcloud import WordCloud  # type: ignore
 
 
@@ -21,6 +27,9 @@ JA_ALLOWED_POS = {"名詞", "形容詞", "動詞"}
 
 EN_PATTERN = re.compile(r"[A-Za-z0-9][A-Za-z0-9']+")
 JA_PATTERN = re.compile(r"[\u3040-\u30ff\u4e00-\u9fff]+")
+LATIN_PATTERN = re.compile(r"[A-Za-z]")
+KATAKANA_PATTERN = re.compile(r"[ァ-ヴー]+")
+KANJI_PATTERN = re.compile(r"[一-龯]")
 URL_PATTERN = re.compile(r"(https?://|www\.)\S+")
 CODE_BLOCK_PATTERN = re.compile(r"```.*?```", flags=re.DOTALL)
 HTML_TAG_PATTERN = re.compile(r"<[^>]+>")
@@ -30,14 +39,33 @@ FOOTNOTE_DEF_PATTERN = re.compile(r"\[\^[^\]]+\]:.*$", flags=re.MULTILINE)
 SHORTCODE_PATTERN = re.compile(r"\{\{.*?\}\}", flags=re.DOTALL)
 SYMBOL_PATTERN = re.compile(r"[*_`>#~\-]+")
 BRACKETS_PATTERN = re.compile(r"[\\\[\]\(\){}<>]")
+EXCLAMATION_PATTERN = re.compile(r"!\s+")
+DIGITS_PATTERN = re.compile(r"(?<![A-Za-z])\d+(?![A-Za-z])")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+# Applied in order; later patterns rely on earlier ones having removed the
+# constructs they could otherwise span across, so the passes are not fused.
+STRIP_PATTERNS = (
+    CODE_BLOCK_PATTERN,
+    URL_PATTERN,
+    HTML_TAG_PATTERN,
+    MARKDOWN_LINK_PATTERN,
+    FOOTNOTE_DEF_PATTERN,
+    FOOTNOTE_REF_PATTERN,
+    SHORTCODE_PATTERN,
+    SYMBOL_PATTERN,
+    BRACKETS_PATTERN,
+)
+
+_DIGITS = frozenset("0123456789")
 
 
 def _load_stopwords(path: Path) -> set[str]:
     """Load stopwords from a file, one word per line."""
     if not path.exists():
         return set()
-    with path.open("r", encoding="utf-8") as fh:
-        return {line.strip() for line in fh if line.strip()}
+    lines = path.read_text(encoding="utf-8").splitlines()
+    return set(filter(None, map(str.strip, lines)))
 
 
 def _load_normalize_config(path: Path) -> dict[str, dict[str, str]]:
@@ -49,27 +77,45 @@ def _load_normalize_config(path: Path) -> dict[str, dict[str, str]]:
 
 
 def _strip_markdown(text: str) -> str:
-    text = CODE_BLOCK_PATTERN.sub(" ", text)
-    text = URL_PATTERN.sub(" ", text)
-    text = HTML_TAG_PATTERN.sub(" ", text)
-    text = MARKDOWN_LINK_PATTERN.sub(" ", text)
-    text = FOOTNOTE_DEF_PATTERN.sub(" ", text)
-    text = FOOTNOTE_REF_PATTERN.sub(" ", text)
-    text = SHORTCODE_PATTERN.sub(" ", text)
-    text = SYMBOL_PATTERN.sub(" ", text)
-    text = BRACKETS_PATTERN.sub(" ", text)
-    text = re.sub(r"!\s+", " ", text)
-    text = re.sub(r"\(\s*\)", " ", text)
-    text = re.sub(r"\{\s*\}", " ", text)
-    text = re.sub(r"(?<![A-Za-z])\d+(?![A-Za-z])", " ", text)
-    text = re.sub(r"\\+", " ", text)
-    text = re.sub(r"\s+", " ", text)
+    for pattern in STRIP_PATTERNS:
+        text = pattern.sub(" ", text)
+    # Parentheses, braces and backslashes are gone after BRACKETS_PATTERN.
+    # The substring checks are much cheaper than a regex scan that finds nothing.
+    if "!" in text:
+        text = EXCLAMATION_PATTERN.sub(" ", text)
+    # \d also matches non-ASCII digits, so only ASCII text can skip the scan
+    if not text.isascii() or any(digit in text for digit in "0123456789"):
+        text = DIGITS_PATTERN.sub(" ", text)
+    text = WHITESPACE_PATTERN.sub(" ", text)
     return text
 
 
-def _load_markdown_text(path: Path) -> str:
-    with path.open("r", encoding="utf-8") as fh:
-        post = frontmatter.load(fh)
+def _walk_markdown(root: Path) -> Iterator[Path]:
+    """Yield markdown files under root, using scandir's cached entry types."""
+    pending = deque([root])
+    while pending:
+        try:
+            scanner = os.scandir(pending.popleft())
+        except PermissionError:
+            continue  # skip unreadable directories, as rglob does
+        with scanner as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(Path(entry.path))
+                elif entry.name.endswith(".md") and entry.is_file():
+                    yield Path(entry.path)
+
+
+def _decode_markdown(raw: bytes) -> str:
+    """Decode file contents with the newline translation read_text() applies."""
+    text = raw.decode("utf-8")
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
+def _extract_markdown_text(source: str) -> str:
+    post = frontmatter.loads(source)
     content = post.content
     if post.get("title"):
         content = f"{post['title']}\n{content}"
@@ -81,26 +127,40 @@ def _normalize_case(text: str, replacements: dict[str, str]) -> str:
     return replacements.get(text, text)
 
 
-def _tokenize_japanese(
-    text: str, stopwords_ja: set[str], normalize_ja: dict[str, str]
-) -> Iterable[str]:
+@functools.lru_cache(maxsize=1)
+def _get_tagger() -> MeCab.Tagger:
+    """Return a shared MeCab tagger so the dictionary is loaded only once."""
     tagger = MeCab.Tagger("")
     tagger.parse("")  # required workaround for some MeCab builds
-    node = tagger.parseToNode(text)
+    return tagger
+
+
+def _tokenize_japanese(
+    text: str,
+    stopwords_ja: set[str],
+    normalize_ja: dict[str, str],
+    normalize_en: dict[str, str],
+) -> list[str]:
+    tokens: list[str] = []
+    node = _get_tagger().parseToNode(text)
     while node:
         surface = node.surface
         if surface:
-            features = node.feature.split(",")
-            pos = features[0] if features else ""
+            # Only the POS (field 0) and lemma (field 6) are needed
+            features = node.feature.split(",", 7)
+            pos = features[0]
             lemma = features[6] if len(features) > 6 else ""
             base = lemma if lemma not in ("*", "") else surface
-            if re.fullmatch(r"[ァ-ヴー]+", base) and re.search(r"[一-龯]", surface):
+            if KATAKANA_PATTERN.fullmatch(base) and KANJI_PATTERN.search(surface):
                 base = surface
             base = _normalize_case(base, normalize_ja)
             if pos in JA_ALLOWED_POS and base not in stopwords_ja and len(base) > 1:
-                yield base
+                # MeCab also yields Latin words; fold their case like English ones
+                if LATIN_PATTERN.search(base):
+                    base = _normalize_en_case(base, normalize_en)
+                tokens.append(base)
         node = node.next
-    return
+    return tokens
 
 
 def _normalize_en_case(token: str, overrides: dict[str, str]) -> str:
@@ -112,17 +172,38 @@ def _normalize_en_case(token: str, overrides: dict[str, str]) -> str:
     return lowered
 
 
-def _tokenize_english(
-    text: str, stopwords_en: set[str], normalize_en: dict[str, str]
-) -> Iterable[str]:
-    for match in EN_PATTERN.findall(text):
+def _english_normalizer(
+    stopwords_en: set[str], normalize_en: dict[str, str]
+) -> Callable[[str], str | None]:
+    """Build a memoized mapping from a raw match to its token, or None if dropped."""
+
+    @functools.cache
+    def normalize(match: str) -> str | None:
         token = _normalize_en_case(match, normalize_en)
         # Check stopwords with case-insensitive comparison
         if token.lower() in stopwords_en:
-            continue
-        if len(token) <= 2 and not any(char.isdigit() for char in token):
-            continue
-        yield token
+            return None
+        if len(token) <= 2 and _DIGITS.isdisjoint(token):
+            return None
+        # Fold override results once more so that, e.g., k8s -> Kubernetes ends
+        # up merged with plain "kubernetes" as it did when main re-normalized
+        # the collected counts.
+        if LATIN_PATTERN.search(token):
+            token = _normalize_en_case(token, normalize_en)
+        return token
+
+    return normalize
+
+
+def _tokenize_english(
+    text: str, normalize_en: Callable[[str], str | None]
+) -> list[str]:
+    tokens: list[str] = []
+    for match in EN_PATTERN.findall(text):
+        token = normalize_en(match)
+        if token is not None:
+            tokens.append(token)
+    return tokens
 
 
 def tokenize(
@@ -131,27 +212,171 @@ def tokenize(
     stopwords_en: set[str],
     normalize_ja: dict[str, str],
     normalize_en: dict[str, str],
+    *,
+    english_token: Callable[[str], str | None] | None = None,
 ) -> list[str]:
-    tokens: list[str] = []
-    tokens.extend(_tokenize_japanese(text, stopwords_ja, normalize_ja))
-    tokens.extend(_tokenize_english(text, stopwords_en, normalize_en))
+    """Tokenize text; pass english_token to reuse a memoized normalizer."""
+    if english_token is None:
+        english_token = _english_normalizer(stopwords_en, normalize_en)
+    tokens = _tokenize_japanese(text, stopwords_ja, normalize_ja, normalize_en)
+    tokens.extend(_tokenize_english(text, english_token))
     return tokens
 
 
+# Tokenizer settings installed in each worker process by _init_worker.
+_worker_config: tuple[set[str], set[str], dict[str, str], dict[str, str]]
+_worker_english_token: Callable[[str], str | None]
+_worker_cache_dir: Path | None
+
+# Cached counts not used for this long are removed by _prune_cache.
+CACHE_MAX_AGE = 30 * 24 * 60 * 60
+# Names created by collect_tokens/_process_one_file; nothing else is pruned.
+CACHE_NAMESPACE_PATTERN = re.compile(r"[0-9a-f]{16}")
+CACHE_ENTRY_PATTERN = re.compile(r"[0-9a-f]{64}(?:\.pkl|\.\d+\.tmp)")
+
+
+def _cache_namespace(
+    stopwords_ja: set[str],
+    stopwords_en: set[str],
+    normalize_ja: dict[str, str],
+    normalize_en: dict[str, str],
+) -> str:
+    """Hash the script, environment and settings that cached counts depend on."""
+    digest = hashlib.sha256(Path(__file__).read_bytes())
+    dictionary = _get_tagger().dictionary_info()
+    environment = [
+        platform.python_version(),  # the re engine ships with the interpreter
+        MeCab.VERSION,
+        dictionary.filename,
+        dictionary.version,
+        dictionary.size,
+    ]
+    settings = [sorted(stopwords_ja), sorted(stopwords_en), normalize_ja, normalize_en]
+    digest.update(json.dumps([environment, settings], sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def _prune_cache(cache_root: Path) -> None:
+    """Remove cached counts unused for CACHE_MAX_AGE and empty namespaces.
+
+    Only namespace directories and entries named the way this script names
+    them are touched, so a shared --cache-dir is safe.
+    """
+    cutoff = time.time() - CACHE_MAX_AGE
+    for namespace in cache_root.iterdir():
+        if (
+            not CACHE_NAMESPACE_PATTERN.fullmatch(namespace.name)
+            or namespace.is_symlink()
+            or not namespace.is_dir()
+        ):
+            continue
+        for entry in namespace.iterdir():
+            if not CACHE_ENTRY_PATTERN.fullmatch(entry.name):
+                continue
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    entry.unlink()
+            except OSError:
+                pass
+        try:
+            namespace.rmdir()  # only succeeds once the namespace is empty
+        except OSError:
+            pass
+
+
+def _init_worker(
+    stopwords_ja: set[str],
+    stopwords_en: set[str],
+    normalize_ja: dict[str, str],
+    normalize_en: dict[str, str],
+    cache_dir: Path | None,
+) -> None:
+    global _worker_config, _worker_english_token, _worker_cache_dir
+    _worker_config = (stopwords_ja, stopwords_en, normalize_ja, normalize_en)
+    _worker_english_token = _english_normalizer(stopwords_en, normalize_en)
+    _worker_cache_dir = cache_dir
+    _get_tagger()
+
+
+def _process_one_file(path: Path) -> Counter[str]:
+    raw = path.read_bytes()
+    cache_path = None
+    if _worker_cache_dir is not None:
+        key = hashlib.sha256(raw).hexdigest()
+        cache_path = _worker_cache_dir / f"{key}.pkl"
+        try:
+            with cache_path.open("rb") as fh:
+                counter = pickle.load(fh)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            pass
+        else:
+            try:
+                os.utime(cache_path)  # mark as recently used for _prune_cache
+            except OSError:
+                pass
+            return counter
+
+    text = _extract_markdown_text(_decode_markdown(raw))
+    counter = Counter(
+        tokenize(text, *_worker_config, english_token=_worker_english_token)
+    )
+
+    if cache_path is not None:
+        # Write then rename so concurrent workers never see a partial file
+        tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            with tmp_path.open("wb") as fh:
+                pickle.dump(counter, fh)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            tmp_path.unlink(missing_ok=True)
+    return counter
+
+
 def collect_tokens(
     paths: Iterable[Path],
     stopwords_ja: set[str],
     stopwords_en: set[str],
     normalize_ja: dict[str, str],
     normalize_en: dict[str, str],
+    cache_dir: Path | None = None,
 ) -> Counter[str]:
+    """Count tokens over all files, reusing per-file counts cached in cache_dir."""
+    settings = (stopwords_ja, stopwords_en, normalize_ja, normalize_en)
+    cache_root = cache_dir
+    if cache_root is not None:
+        cache_dir = cache_root / _cache_namespace(*settings)
+        try:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+        except OSError as exc:
+            print(f"Token cache disabled: {exc}")
+            cache_root = cache_dir = None
+
     counter: Counter[str] = Counter()
-    for path in paths:
-        text = _load_markdown_text(path)
-        for token in tokenize(
-            text, stopwords_ja, stopwords_en, normalize_ja, normalize_en
-        ):
-            counter[token] += 1
+    paths = list(paths)
+    max_workers = min(os.cpu_count() or 1, len(paths))
+    if max_workers <= 1:
+        # MeCab holds the GIL, so threads would not help either; with a single
+        # worker just skip the process startup and pickling.
+        _init_worker(*settings, cache_dir)
+        for path in paths:
+            counter.update(_process_one_file(path))
+    else:
+        # About four chunks per worker keeps the load balanced without sending
+        # every file as its own task.
+        chunksize = max(1, len(paths) // (max_workers * 4))
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=_init_worker,
+            initargs=(*settings, cache_dir),
+        ) as executor:
+            for file_counter in executor.map(
+                _process_one_file, paths, chunksize=chunksize
+            ):
+                counter.update(file_counter)
+
+    if cache_root is not None:
+        _prune_cache(cache_root)
     return counter
 
 
@@ -217,6 +442,17 @@ def parse_args() -> argparse.Namespace:
         default=Path("normalize.json"),
         help="Path to case normalization config file (JSON with 'en' and 'ja' keys).",
     )
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=Path(".cache/wordcloud"),
+        help="Directory to cache per-file token counts in.",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Tokenize every file without reading or writing the cache.",
+    )
     return parser.parse_args()
 
 
@@ -224,7 +460,7 @@ def main() -> None:
     args = parse_args()
     target = args.target
     if target.is_dir():
-        md_paths = sorted(p for p in target.rglob("*.md") if p.is_file())
+        md_paths = sorted(_walk_markdown(target))
     elif target.is_file():
         if target.suffix.lower() != ".md":
             raise SystemExit(f"Target file must be a markdown file: {target}")
@@ -242,20 +478,17 @@ def main() -> None:
 
     print(f"Scanning markdown files under {target} ...")
     counter = collect_tokens(
-        md_paths, stopwords_ja, stopwords_en, normalize_ja, normalize_en
+        md_paths,
+        stopwords_ja,
+        stopwords_en,
+        normalize_ja,
+        normalize_en,
+        cache_dir=None if args.no_cache else args.cache_dir,
     )
     if not counter:
         raise SystemExit("No tokens were extracted from the provided directory.")
 
-    normalized_counter: Counter[str] = Counter()
-    for token, freq in counter.items():
-        if re.search(r"[A-Za-z]", token):
-            norm = _normalize_en_case(token, normalize_en)
-        else:
-            norm = token
-        normalized_counter[norm] += freq
-
-    top_list = normalized_counter.most_common(args.top)
+    top_list = counter.most_common(args.top)
     log_lines = [f"{token}\t{freq}" for token, freq in top_list]
     args.log.write_text("\n".join(log_lines), encoding="utf-8")
     print(f"Top tokens written to {args.log}")
@@ -272,8 +505,7 @@ def main() -> None:
         stopwords=stopwords_en,
         prefer_horizontal=1.0,
     ).generate_from_frequencies(top_tokens)
-    light_array = wc_light.to_array()
-    Image.fromarray(light_array).save(str(args.output))
+    wc_light.to_image().save(str(args.output))
     print(f"Word cloud image saved to {args.output}")
 
 